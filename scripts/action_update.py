@@ -1,15 +1,24 @@
 from __future__ import annotations
 
 import argparse
+import json
 import os
 import re
 import sys
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 from functools import cache
+from hashlib import sha256
+from itertools import count
 from pathlib import Path
 
 import httpx
+import platformdirs
 from rich.console import Console
+from rich.table import Table
 
 from utilities import trackpool
 
@@ -23,6 +32,14 @@ USES_PATTERN = re.compile(
     r"(uses:\s*)([A-Za-z0-9_.-]+/[A-Za-z0-9_./:-]+)@([^\s#]+)([ \t]*#[^\n]*)?"
 )
 SHA_PATTERN = re.compile(r"^[0-9a-f]{40}$", re.IGNORECASE)
+VERSION_PATTERN = re.compile(r"([^0-9]*)(\d+(?:\.\d+)*)")
+CACHE_PATH = platformdirs.user_cache_path() / "holoviz-cli" / "action_update"
+CACHE_PATH.mkdir(parents=True, exist_ok=True)
+GRAPHQL_BATCH = 50
+PER_PAGE = 100
+LOCK_NAME = "actions.lock"
+
+VersionIndex = dict[str, list[tuple[tuple[int, ...], str]]]
 
 HOLOVIZ_TASKS_REPO = "holoviz-dev/holoviz_tasks"
 HOLOVIZ_TASKS_RENAMES = {
@@ -32,28 +49,167 @@ HOLOVIZ_TASKS_RENAMES = {
 
 console = Console()
 
+# Filled by prefetch_refs, looked up before falling back to the REST API
+PREFETCHED_INDEXES: dict[tuple[str, str], VersionIndex] = {}
+PREFETCHED_SHAS: dict[tuple[str, str], str] = {}
+
 
 @cache
 def github_api(path: str) -> list | dict:
     url = f"https://api.github.com/{path}"
     with suppress(httpx.HTTPError):
-        return (
-            httpx.get(url, headers=HEADERS, params={"per_page": 100, "page": 1})
-            .raise_for_status()
-            .json()
-        )
+        return httpx.get(url, headers=HEADERS).raise_for_status().json()
 
 
-def get_names(path: str) -> list[str] | None:
-    data = github_api(path)
-    if not isinstance(data, list):
-        return None
-    return [item["name"] for item in data if "name" in item]
+def github_api_pages(path: str, etags: list[str] | None = None) -> tuple[list | None, list[str]]:
+    """
+    Return all pages of a list endpoint with the ETag of each page, or None
+    if no page changed since the given ETags.
+
+    Pages are fetched until one is not full, so a ref added after a full
+    last page shows up as a change of the following, empty, page.
+    """
+    url = f"https://api.github.com/{path}"
+    with httpx.Client(headers=HEADERS) as client:
+
+        def unchanged(page: int, etag: str) -> bool:
+            params = {"per_page": PER_PAGE, "page": page}
+            resp = client.get(url, headers={"If-None-Match": etag}, params=params)
+            return resp.status_code == httpx.codes.NOT_MODIFIED
+
+        if etags and all(etag and unchanged(page, etag) for page, etag in enumerate(etags, 1)):
+            return None, etags
+
+        items, etags = [], []
+        for page in count(1):
+            resp = client.get(url, params={"per_page": PER_PAGE, "page": page}).raise_for_status()
+            etags.append(resp.headers.get("ETag"))
+            page_items = resp.json()
+            items.extend(page_items)
+            if len(page_items) < PER_PAGE:
+                break
+    return items, etags
+
+
+def run_query(query: str) -> dict:
+    resp = httpx.post(
+        "https://api.github.com/graphql", json={"query": query}, headers=HEADERS, timeout=60
+    ).raise_for_status()
+    # Missing repos are reported as errors next to the partial data
+    return resp.json().get("data") or {}
+
+
+def prefetch_refs(repos: set[str], max_age: float = 24) -> None:
+    """
+    Fetch the tags and branches of all repos, with their peeled commit SHAs,
+    using aliased GraphQL queries of up to GRAPHQL_BATCH connections each.
+
+    The refs of each repo are stored on disk and only fetched again when
+    they are older than max_age hours.
+    """
+    now = time.time()
+    stale = set()
+    for repo in repos:
+        cache_file = CACHE_PATH / f"{repo.replace('/', '_')}_refs.json"
+        cached = json.loads(cache_file.read_text()) if cache_file.exists() else None
+        if cached and now - cached["fetched"] < max_age * 3600:
+            store_prefetched(repo, cached)
+        else:
+            stale.add(repo)
+
+    fields = "pageInfo { hasNextPage endCursor } nodes { name target { oid ... on Tag { target { oid } } } }"
+    pending: dict[tuple[str, str], str | None] = {
+        (repo, kind): None for repo in sorted(stale) for kind in ("tags", "heads")
+    }
+    refs = {repo: {"fetched": now, "tags": {}, "heads": {}} for repo in stale}
+    failed = set()
+    while pending:
+        batch = list(pending.items())[:GRAPHQL_BATCH]
+        aliases = []
+        for i, ((repo, kind), cursor) in enumerate(batch):
+            owner, name = repo.split("/")
+            after = f", after: {json.dumps(cursor)}" if cursor else ""
+            aliases.append(
+                f"r{i}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) "
+                f'{{ refs(refPrefix: "refs/{kind}/", first: 100{after}) {{ {fields} }} }}'
+            )
+        try:
+            data = run_query(f"{{ {' '.join(aliases)} }}")
+        except httpx.HTTPError:
+            return
+
+        for i, ((repo, kind), _) in enumerate(batch):
+            del pending[repo, kind]
+            repository = data.get(f"r{i}")
+            if repository is None:
+                failed.add(repo)
+                continue
+            repo_refs = repository["refs"]
+            for node in repo_refs["nodes"]:
+                target = node["target"]
+                refs[repo][kind][node["name"]] = target.get("target", target)["oid"]
+            if repo_refs["pageInfo"]["hasNextPage"]:
+                pending[repo, kind] = repo_refs["pageInfo"]["endCursor"]
+
+    for repo in stale - failed:
+        (CACHE_PATH / f"{repo.replace('/', '_')}_refs.json").write_text(json.dumps(refs[repo]))
+        store_prefetched(repo, refs[repo])
+
+
+def store_prefetched(repo: str, refs: dict) -> None:
+    PREFETCHED_INDEXES[repo, "tags"] = build_version_index(list(refs["tags"]))
+    PREFETCHED_INDEXES[repo, "branches"] = build_version_index(list(refs["heads"]))
+    # Tags take precedence over branches, like in resolve_sha
+    for kind in ("heads", "tags"):
+        PREFETCHED_SHAS.update({(repo, name): sha for name, sha in refs[kind].items()})
+
+
+def build_version_index(names: list[str]) -> VersionIndex:
+    """Group versioned names by their prefix, each group sorted by version."""
+    index = defaultdict(list)
+    for name in names:
+        if m := VERSION_PATTERN.fullmatch(name):
+            index[m.group(1)].append((_parse_version(m.group(2)), name))
+    return {prefix: sorted(entries) for prefix, entries in index.items()}
+
+
+@cache
+def get_version_index(repo: str, kind: str) -> VersionIndex | None:
+    """
+    Return the version index of a repo's tags or branches.
+
+    The refs from prefetch_refs are used if available. Otherwise, the index
+    is stored on disk with the ETag of every page and is revalidated on
+    each run, so an unchanged repo only costs a 304 response per page.
+    """
+    if (repo, kind) in PREFETCHED_INDEXES:
+        return PREFETCHED_INDEXES[repo, kind]
+
+    cache_file = CACHE_PATH / f"{repo.replace('/', '_')}_{kind}.json"
+    cached = json.loads(cache_file.read_text()) if cache_file.exists() else {}
+    try:
+        items, etags = github_api_pages(f"repos/{repo}/{kind}", cached.get("etags"))
+    except httpx.HTTPError:
+        if "versions" not in cached:
+            return None
+        items, etags = None, cached.get("etags")
+
+    if items is None:
+        return {
+            prefix: [(tuple(version), name) for version, name in entries]
+            for prefix, entries in cached["versions"].items()
+        }
+
+    index = build_version_index([item["name"] for item in items if "name" in item])
+    cache_file.write_text(json.dumps({"etags": etags, "versions": index}))
+    return index
 
 
 @cache
 def resolve_sha(repo: str, ref: str) -> str | None:
     """Resolve a tag or branch name to its commit SHA (handles annotated and lightweight tags)."""
+    if (repo, ref) in PREFETCHED_SHAS:
+        return PREFETCHED_SHAS[repo, ref]
     for git_ref in (f"tags/{ref}", f"heads/{ref}"):
         data = github_api(f"repos/{repo}/git/ref/{git_ref}")
         if not isinstance(data, dict):
@@ -76,37 +232,37 @@ def find_latest_tag(repo: str, ref: str, expand: bool = False) -> str | None:
     if ref in SKIP_REFS:
         return None
 
-    m = re.match(r"^([^0-9]*)(\d+(?:\.\d+)*)$", ref)
+    m = VERSION_PATTERN.fullmatch(ref)
     if not m:
         return None
 
     prefix = m.group(1)
     version_str = m.group(2)
     current_version = _parse_version(version_str)
-    escaped = re.escape(prefix)
     has_dot = "." in version_str
     expanding = expand and not has_dot
-    version_pattern = escaped + (r"(\d+(?:\.\d+)*)" if (has_dot or expanding) else r"(\d+)")
 
-    for endpoint in (f"repos/{repo}/tags", f"repos/{repo}/branches"):
-        names = get_names(endpoint)
-        if names is None:
+    for kind in ("tags", "branches"):
+        index = get_version_index(repo, kind)
+        if index is None:
             continue
 
-        candidates = [
-            (_parse_version(cm.group(1)), name)
-            for name in names
-            if (cm := re.fullmatch(version_pattern, name))
-            and (
-                not expanding
-                or (
-                    _parse_version(cm.group(1))[: len(current_version)] == current_version
-                    and len(_parse_version(cm.group(1))) > len(current_version)
-                )
-            )
-        ]
+        entries = index.get(prefix, [])
+        if expanding:
+            # Versions starting with current_version sort directly after it,
+            # e.g. (1,) < (1, 0) < (1, 2, 3) < (2,)
+            versions = [version for version, _ in entries]
+            upper = (*current_version[:-1], current_version[-1] + 1)
+            lo = bisect_right(versions, current_version)
+            hi = bisect_left(versions, upper)
+            candidates = entries[lo:hi]
+        elif has_dot:
+            candidates = entries
+        else:
+            candidates = [entry for entry in entries if len(entry[0]) == 1]
+
         if candidates:
-            best_version, best_name = max(candidates, key=lambda x: x[0])
+            best_version, best_name = candidates[-1]
             return best_name if best_version > current_version else None
 
     return None
@@ -147,34 +303,72 @@ def latest_for_ref(
     return repo, ref, latest_tag, None
 
 
+def find_workflow_files(workflows_dir: Path) -> list[Path]:
+    return sorted(list(workflows_dir.glob("*.yml")) + list(workflows_dir.glob("*.yaml")))
+
+
+def find_workspace_files(workspace: Path) -> list[Path]:
+    workflows_dirs = [
+        d for repo in sorted(workspace.iterdir()) if (d := repo / ".github" / "workflows").is_dir()
+    ]
+    with ThreadPoolExecutor() as executor:
+        return [f for files in executor.map(find_workflow_files, workflows_dirs) for f in files]
+
+
+def read_files(workflow_files: list[Path]) -> dict[Path, str]:
+    with ThreadPoolExecutor() as executor:
+        return dict(zip(workflow_files, executor.map(Path.read_text, workflow_files), strict=True))
+
+
+def scan_refs(text: str) -> list[tuple[str, str, str | None]]:
+    """Return (action_path, ref, current_tag) for each action used in a workflow."""
+    refs = []
+    for m in USES_PATTERN.finditer(text):
+        ref = m.group(3)
+        comment = m.group(4) or ""
+        current_tag: str | None = None
+        if SHA_PATTERN.match(ref):
+            tag_match = re.search(r"#\s*(\S+)", comment)
+            if tag_match:
+                current_tag = tag_match.group(1)
+        refs.append((m.group(2), ref, current_tag))
+    return refs
+
+
 def collect_refs(
-    workflow_files: list[Path],
+    file_refs: list[list[tuple[str, str, str | None]]],
     pin: bool = False,
     expand: bool = False,
     mutable: bool = False,
     include: str | None = None,
 ) -> list[tuple[str, str, str | None, bool, bool, bool]]:
     seen: dict[tuple[str, str], str | None] = {}
-    for path in workflow_files:
-        for m in USES_PATTERN.finditer(path.read_text()):
-            action_path = m.group(2)
+    for refs in file_refs:
+        for action_path, ref, current_tag in refs:
             if include and include not in action_path:
                 continue
-            parts = action_path.split("/")
-            repo = "/".join(parts[:2])
-            ref = m.group(3)
-            comment = m.group(4) or ""
-            current_tag: str | None = None
-            if SHA_PATTERN.match(ref):
-                tag_match = re.search(r"#\s*(\S+)", comment)
-                if tag_match:
-                    current_tag = tag_match.group(1)
+            repo = "/".join(action_path.split("/")[:2])
             key = (repo, ref)
             if key not in seen:
                 seen[key] = current_tag
     return [(repo, ref, tag, pin, expand, mutable) for (repo, ref), tag in seen.items()]
 
 
+def lock_path(path: Path) -> Path:
+    # .github/workflows/test.yaml -> .github/actions.lock
+    return path.parent.parent / LOCK_NAME
+
+
+def load_lock(path: Path) -> dict:
+    with suppress(FileNotFoundError, json.JSONDecodeError):
+        return json.loads(path.read_text())
+    return {}
+
+
+def text_hash(text: str) -> str:
+    return sha256(text.encode()).hexdigest()
+
+
 def update_files(
     workflow_files: list[Path],
     dry_run: bool = False,
@@ -182,16 +376,72 @@ def update_files(
     expand: bool = False,
     mutable: bool = False,
     include: str | None = None,
+    workspace: Path | None = None,
+    refresh: bool = False,
+    max_age: float = 24,
 ) -> None:
-    refs = collect_refs(workflow_files, pin=pin, expand=expand, mutable=mutable, include=include)
+    """
+    Update the actions in the workflow files.
+
+    With a workspace, the changes of all files are printed as one report
+    with the repos they were made in, instead of per file.
+
+    The hash and actions of each file, and the result of each checked ref,
+    are stored in a lock file next to the workflows directory. Unchanged files
+    are not scanned again, and refs checked less than max_age hours ago are
+    not resolved again unless refresh is set.
+    """
+    texts = read_files(workflow_files)
+    locks = {lp: {} if refresh else load_lock(lp) for lp in map(lock_path, texts)}
+
+    file_refs = {}
+    for path, text in texts.items():
+        lp = lock_path(path)
+        entry = locks[lp].get("files", {}).get(path.relative_to(lp.parent).as_posix())
+        if entry and entry["hash"] == text_hash(text):
+            file_refs[path] = [tuple(r) for r in entry["refs"]]
+        else:
+            file_refs[path] = scan_refs(text)
+
+    refs = collect_refs(
+        list(file_refs.values()), pin=pin, expand=expand, mutable=mutable, include=include
+    )
 
-    for repo, ref, current_tag, *_ in refs:
+    now = time.time()
+    options = [pin, expand, mutable]
+    checked: dict[str, dict] = {}
+    for lock in locks.values():
+        if lock.get("options") != options:
+            continue
+        for key, entry in lock.get("refs", {}).items():
+            fresh = now - entry["checked"] < max_age * 3600
+            if fresh and entry["checked"] > checked.get(key, {}).get("checked", 0):
+                checked[key] = entry
+
+    results = [
+        (repo, ref, checked[key]["tag"], checked[key]["sha"])
+        for repo, ref, *_ in refs
+        if (key := f"{repo}@{ref}") in checked
+    ]
+    todo = [r for r in refs if f"{r[0]}@{r[1]}" not in checked]
+
+    for repo, ref, current_tag, *_ in todo:
         if SHA_PATTERN.match(ref) and current_tag is None:
             console.print(
                 f"[yellow]Warning: cannot update {repo}@{ref} (SHA-pinned with no version comment)[/yellow]"
             )
 
-    results = trackpool(latest_for_ref, refs, "Checking GitHub Actions")
+    if todo:
+        with console.status("Fetching tags and branches of GitHub Actions"):
+            prefetch_refs({repo for repo, *_ in todo}, 0 if refresh else max_age)
+        resolved = trackpool(latest_for_ref, todo, "Checking GitHub Actions")
+        results.extend(resolved)
+        for repo, ref, latest_tag, latest_sha in resolved:
+            checked[f"{repo}@{ref}"] = {"tag": latest_tag, "sha": latest_sha, "checked": now}
+            if latest_tag:
+                # The new ref is the latest one, so it does not need to be checked again
+                new_ref = latest_sha or latest_tag
+                checked[f"{repo}@{new_ref}"] = {"tag": None, "sha": None, "checked": now}
 
     updates: dict[tuple[str, str], tuple[str, str | None] | None] = {
         (repo, ref): (latest_tag, latest_sha) if latest_tag else None
@@ -199,8 +449,15 @@ def update_files(
     }
 
     any_changes = False
-    for path in workflow_files:
-        text = path.read_text()
+    report: dict[tuple[str, str, str], set[str]] = defaultdict(set)
+    for path, text in texts.items():
+        if not any(
+            action_path in HOLOVIZ_TASKS_RENAMES
+            or updates.get(("/".join(action_path.split("/")[:2]), ref))
+            for action_path, ref, _ in file_refs[path]
+        ):
+            continue
+
         changes: list[tuple[str, str, str]] = []
 
         def replacer(m: re.Match, _changes: list = changes) -> str:
@@ -235,17 +492,58 @@ def update_files(
             continue
 
         any_changes = True
+        if not dry_run:
+            path.write_text(new_text)
+            texts[path], file_refs[path] = new_text, scan_refs(new_text)
+        if workspace:
+            for change in changes:
+                report[change].add(path.relative_to(workspace).parts[0])
+            continue
+
         label = "[bold]\\[dry-run][/bold] " if dry_run else ""
         console.print(f"\n{label}[bold]{path}[/bold]")
         col1 = max(len(a) for a, _, _ in changes)
         col2 = max(len(r) for _, r, _ in changes)
         for action_path, ref, latest in changes:
             console.print(f"  {action_path:<{col1}}  @{ref:<{col2}}  ->  @{latest}")
-        if not dry_run:
-            path.write_text(new_text)
 
     if not any_changes:
         console.print("\n[green]All actions are up to date.[/green]")
+    elif workspace:
+        label = " (dry-run)" if dry_run else ""
+        table = Table(title=f"Updated actions in {workspace}{label}")
+        table.add_column("Action")
+        table.add_column("From")
+        table.add_column("To")
+        table.add_column("Repos")
+        for (action_path, ref, latest), repos in sorted(report.items()):
+            table.add_row(action_path, f"@{ref}", f"@{latest}", ", ".join(sorted(repos)))
+        console.print(table)
+
+    if dry_run:
+        return
+
+    groups: dict[Path, dict[str, dict]] = defaultdict(dict)
+    for path, text in texts.items():
+        lp = lock_path(path)
+        groups[lp][path.relative_to(lp.parent).as_posix()] = {
+            "hash": text_hash(text),
+            "refs": file_refs[path],
+        }
+    for lp, files in groups.items():
+        keys = {
+            f"{'/'.join(action_path.split('/')[:2])}@{ref}"
+            for entry in files.values()
+            for action_path, ref, _ in entry["refs"]
+        }
+        lock = {
+            "options": options,
+            "files": files,
+            "refs": {key: checked[key] for key in sorted(keys) if key in checked},
+        }
+        text = json.dumps(lock, indent=2)
+        if json.loads(text) != locks[lp]:
+            lp.write_text(text + "\n")
 
 
 def main() -> None:
@@ -274,14 +572,34 @@ def main() -> None:
         "--include",
         help="Only update actions whose name contains this string",
     )
+    parser.add_argument(
+        "--workspace",
+        action="store_true",
+        help="Update the workflows of every repo in $HOLOVIZ_REP instead of a single directory",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help=f"Check all files and refs, ignoring the {LOCK_NAME} file",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=24,
+        help="Hours before a checked ref is checked again (default: 24)",
+    )
     args = parser.parse_args()
 
-    workflows_dir = Path(args.workflows_dir)
+    workspace = Path(os.environ["HOLOVIZ_REP"]) if args.workspace else None
+    workflows_dir = workspace or Path(args.workflows_dir)
     if not workflows_dir.is_dir():
         print(f"Error: {workflows_dir} is not a directory", file=sys.stderr)
         sys.exit(1)
 
-    workflow_files = sorted(list(workflows_dir.glob("*.yml")) + list(workflows_dir.glob("*.yaml")))
+    if workspace:
+        workflow_files = find_workspace_files(workspace)
+    else:
+        workflow_files = find_workflow_files(workflows_dir)
     if not workflow_files:
         console.print("No workflow files found.")
         return
@@ -296,6 +614,9 @@ def main() -> None:
         expand=args.expand,
         mutable=args.mutable,
         include=args.include,
+        workspace=workspace,
+        refresh=args.refresh,
+        max_age=args.max_age,
     )
 
 
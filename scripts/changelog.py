@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import json
 import os
 import re
 from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import cache
 
 import httpx
+import platformdirs
 import rich_click as click
 from pandas.io.clipboard import clipboard_set
 from rich.console import Console
@@ -21,15 +25,37 @@ REPOS = ["holoviews", "panel", "hvplot", "datashader", "geoviews", "lumen", "spa
 console = Console()
 ME = "hoxbro"
 IGNORE_CONTRIBUTORS = {"renovate", "dependabot", "pre-commit-ci"}
+CACHE_PATH = platformdirs.user_cache_path() / "holoviz-cli" / "changelog"
+CACHE_PATH.mkdir(parents=True, exist_ok=True)
+STATE_OVERLAP = timedelta(hours=1)
 
 
+@cache
 def get_releases(owner, repo):
-    url = f"https://api.github.com/repos/{owner}/{repo}/releases"
+    """
+    Return all non-prerelease tags, newest first.
 
-    with httpx.Client() as client:
-        response = client.get(url, headers=HEADERS)
+    The result is cached on disk together with the ETag of the first page,
+    so an unchanged release list only costs a 304 response.
+    """
+    url = f"https://api.github.com/repos/{owner}/{repo}/releases"
+    cache_file = CACHE_PATH / f"{owner}_{repo}_releases.json"
+    cached = json.loads(cache_file.read_text()) if cache_file.exists() else {}
+    headers = {**HEADERS, "If-None-Match": cached["etag"]} if cached.get("etag") else HEADERS
+
+    with httpx.Client(headers=HEADERS) as client:
+        response = client.get(url, headers=headers, params={"per_page": 100})
+        if response.status_code == httpx.codes.NOT_MODIFIED:
+            return cached["tags"]
         response.raise_for_status()
-    tags = [r["tag_name"] for r in response.json() if not r["prerelease"]]
+        etag = response.headers.get("ETag")
+        releases = response.json()
+        while next_page := response.links.get("next"):
+            response = client.get(next_page["url"]).raise_for_status()
+            releases.extend(response.json())
+
+    tags = [r["tag_name"] for r in releases if not r["prerelease"]]
+    cache_file.write_text(json.dumps({"etag": etag, "tags": tags}))
     return tags
 
 
@@ -46,25 +72,8 @@ def run_query(query, variables):
     return data["data"]
 
 
-def get_commit_date(repo, oid):
+def get_commit_date(commit):
     """Return mergedAt of a commit's associated PR, or committedDate as fallback."""
-    owner, name = repo.split("/")
-    query_gql = """
-    query($owner:String!, $name:String!, $oid:GitObjectID!) {
-      repository(owner:$owner, name:$name) {
-        object(oid:$oid) {
-          ... on Commit {
-            committedDate
-            associatedPullRequests(first: 1) {
-              nodes { mergedAt }
-            }
-          }
-        }
-      }
-    }
-    """
-    data = run_query(query_gql, {"owner": owner, "name": name, "oid": oid})
-    commit = data["repository"]["object"]
     nodes = commit["associatedPullRequests"]["nodes"]
     return nodes[0]["mergedAt"] if nodes else commit["committedDate"]
 
@@ -73,12 +82,10 @@ def get_prs_between_tags(repo, from_commit_date, to_commit_date):
     """
     Fetch all merged PRs between two commit dates using GraphQL search.
     Returns:
-      - commit_lines: list of markdown-formatted PR lines
-      - contributors: set of usernames
+      - prs: dict of PR number to its markdown-formatted line, author and merge date
     """
     owner, name = repo.split("/")
-    commit_lines = []
-    contributors = set()
+    prs = {}
     cursor = None
 
     query_str = f"repo:{owner}/{name} is:pr is:merged merged:{from_commit_date}..{to_commit_date}"
@@ -104,19 +111,43 @@ def get_prs_between_tags(repo, from_commit_date, to_commit_date):
         data = run_query(query_gql, {"query": query_str, "cursor": cursor})
         nodes = data["search"]["nodes"]
         for pr in nodes:
-            username = pr["author"]["login"] if pr["author"] else "unknown"
-            contributors.add(username)
-            commit_lines.append(
-                pr_format.format(title=pr["title"], number=pr["number"], owner=owner, repo=name)
-            )
+            prs[str(pr["number"])] = {
+                "line": pr_format.format(
+                    title=pr["title"], number=pr["number"], owner=owner, repo=name
+                ),
+                "author": pr["author"]["login"] if pr["author"] else "unknown",
+                "merged_at": pr["mergedAt"],
+            }
 
         page_info = data["search"]["pageInfo"]
         if not page_info["hasNextPage"]:
             break
         cursor = page_info["endCursor"]
 
-    contributors -= IGNORE_CONTRIBUTORS
-    return commit_lines, contributors
+    return prs
+
+
+def state_path(repo, from_tag):
+    return CACHE_PATH / f"{repo.replace('/', '_')}_{from_tag.replace('/', '_')}.json"
+
+
+def load_state(repo, from_tag, from_commit_date):
+    """
+    Load the stored PRs for a (repo, from_tag) pair.
+
+    The state is discarded if the tag has been moved since it was stored.
+    """
+    state_file = state_path(repo, from_tag)
+    if not state_file.exists():
+        return {}
+    state = json.loads(state_file.read_text())
+    if state.get("from_commit_date") != from_commit_date:
+        return {}
+    return state
+
+
+def save_state(repo, from_tag, state):
+    state_path(repo, from_tag).write_text(json.dumps(state))
 
 
 def categorize_commits(commit_lines):
@@ -250,34 +281,64 @@ def is_new_contributor(repo, username, from_commit_date):
     return merged_at >= from_commit_date
 
 
-def generate_changelog(repo, from_tag, to_tag):
+def generate_changelog(repo, from_tag, to_tag, refresh=False):
     owner, name = repo.split("/")
 
-    # Resolve tags → commit OIDs
+    # Resolve tags → commit OIDs and dates in a single request
     query_gql = """
     query($owner:String!, $name:String!, $from:String!, $to:String!) {
       repository(owner:$owner, name:$name) {
-        from: object(expression:$from) { ... on Commit { oid } }
-        to: object(expression:$to) { ... on Commit { oid } }
+        from: object(expression:$from) { ...CommitDate }
+        to: object(expression:$to) { ...CommitDate }
+      }
+    }
+    fragment CommitDate on Commit {
+      oid
+      committedDate
+      associatedPullRequests(first: 1) {
+        nodes { mergedAt }
       }
     }
     """
     data = run_query(query_gql, {"owner": owner, "name": name, "from": from_tag, "to": to_tag})
-    from_oid = data["repository"]["from"]["oid"]
-    to_oid = data["repository"]["to"]["oid"]
-
-    # Get commit dates of tags
-    from_commit_date = get_commit_date(repo, from_oid)
-    to_commit_date = get_commit_date(repo, to_oid)
+    from_commit_date = get_commit_date(data["repository"]["from"])
+    to_commit_date = get_commit_date(data["repository"]["to"])
+
+    # Only fetch PRs merged since the last generation from the same tag,
+    # with some overlap as the search index can lag behind a merge.
+    state = {} if refresh else load_state(repo, from_tag, from_commit_date)
+    prs = state.get("prs", {})
+    known_contributors = state.get("contributors", {})
+    high_water = state.get("merged_at", from_commit_date)
+    if to_commit_date > high_water:
+        since = datetime.fromisoformat(high_water) - STATE_OVERLAP
+        prs |= get_prs_between_tags(repo, f"{since:%Y-%m-%dT%H:%M:%SZ}", to_commit_date)
+        high_water = to_commit_date
 
     # Get PRs and contributors between tags
-    commit_lines, contributors = get_prs_between_tags(repo, from_commit_date, to_commit_date)
+    selected = sorted(
+        (pr for pr in prs.values() if from_commit_date <= pr["merged_at"] <= to_commit_date),
+        key=lambda pr: pr["merged_at"],
+        reverse=True,
+    )
+    commit_lines = [pr["line"] for pr in selected]
+    contributors = {pr["author"] for pr in selected} - IGNORE_CONTRIBUTORS
 
     # Classify new vs existing contributors
-    new_contributors = set()
-    for username in contributors:
-        if is_new_contributor(repo, username, from_commit_date):
-            new_contributors.add(username)
+    for username in contributors - known_contributors.keys():
+        known_contributors[username] = is_new_contributor(repo, username, from_commit_date)
+    new_contributors = {username for username in contributors if known_contributors[username]}
+
+    save_state(
+        repo,
+        from_tag,
+        {
+            "from_commit_date": from_commit_date,
+            "merged_at": high_water,
+            "prs": prs,
+            "contributors": known_contributors,
+        },
+    )
 
     # Categorize commits
     categorized_commits = categorize_commits(commit_lines)
@@ -308,7 +369,12 @@ def generate_changelog(repo, from_tag, to_tag):
 )
 @click.argument("use_latest", type=bool, default=True)
 @click.argument("branch", type=str, default="main")
-def cli(repo, use_latest, branch) -> None:
+@click.option(
+    "--refresh/--no-refresh",
+    default=False,
+    help="Ignore the stored state and fetch the full range of PRs",
+)
+def cli(repo, use_latest, branch, refresh) -> None:
     owner = "holoviz"
     releases = get_releases(owner, repo)
 
@@ -331,7 +397,7 @@ def cli(repo, use_latest, branch) -> None:
     with console.status(
         f"Generating changelog for {repo} for latest release {from_tag} to {to_tag}..."
     ):
-        text = generate_changelog(repo_full, from_tag, to_tag)
+        text = generate_changelog(repo_full, from_tag, to_tag, refresh=refresh)
 
     clipboard_set(text)
     console.print(Markdown(text))
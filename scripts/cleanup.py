@@ -2,29 +2,85 @@
 
 from __future__ import annotations
 
+import argparse
+import fnmatch
+import json
 import os
 import re
+import tarfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import suppress
-from functools import cache
+from datetime import datetime
+from hashlib import sha256
 from pathlib import Path
 from shutil import move, rmtree
-from subprocess import check_output
 
 import httpx
-from bs4 import BeautifulSoup
+import platformdirs
 from rich.console import Console
+from rich.filesize import decimal
 
 from utilities import trackpool
 
 console = Console()
 PATH = Path(os.environ["HOLOVIZ_DEV"]).resolve() / "development"
 
-# Not needed but makes it faster
 HEADERS = {
     "Accept": "application/vnd.github+json",
     "Authorization": f"Bearer {os.environ['GITHUB_TOKEN']}",
     "X-GitHub-Api-Version": "2022-11-28",
 }
+GRAPHQL_BATCH = 100
+CACHE_PATH = platformdirs.user_cache_path() / "holoviz-cli" / "cleanup"
+CACHE_PATH.mkdir(parents=True, exist_ok=True)
+STATES_FILE = CACHE_PATH / "states.json"
+NOTEBOOKS_FILE = CACHE_PATH / "notebooks.json"
+
+
+TEMP_PATTERNS = [
+    ".ipynb_checkpoints",
+    "Untitled*.ipynb",
+    "tmp*.py",
+    "temp*.py",
+    "untitled*.txt",
+    ".benchmarks",
+    ".hypothesis",
+    ".*_cache",
+    "__pycache__",
+    "log*.txt",
+    "cache",
+]
+TEMP_MATCH = re.compile("|".join(map(fnmatch.translate, TEMP_PATTERNS))).match
+
+
+def find_temp(root: Path) -> list[Path]:
+    """Walk root once, collecting temporary files and directories without descending into them."""
+    found, stack = [], [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if TEMP_MATCH(entry.name):
+                    found.append(Path(entry.path))
+                elif entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+    return found
+
+
+def remove_path(path: Path) -> int:
+    """Remove a file or directory, returning the number of bytes reclaimed."""
+    if path.is_symlink() or not path.is_dir():
+        size = path.lstat().st_size
+        path.unlink()
+        return size
+    size = sum(
+        os.lstat(os.path.join(dirpath, f)).st_size
+        for dirpath, _, files in os.walk(path)
+        for f in files
+    )
+    rmtree(path)
+    return size
 
 
 def remove_temp() -> None:
@@ -33,53 +89,125 @@ def remove_temp() -> None:
         with suppress(Exception):
             move(file, PATH)
 
-    tmps = [
-        ".ipynb_checkpoints",
-        "Untitled*.ipynb",
-        "tmp*.py",
-        "temp*.py",
-        "untitled*.txt",
-        ".benchmarks",
-        ".hypothesis",
-        ".*_cache",
-        "__pycache__",
-        "log*.txt",
-        "cache",
-    ]
-
-    for tmp in tmps:
-        for f in PATH.rglob(tmp):
-            if f.is_file():
-                f.unlink()
-            else:
-                rmtree(f)
-
-            console.print(
-                f"Removed {f.relative_to(PATH)}",
-                style="bright_black",
-            )
+    tmps = find_temp(PATH)
+    sizes = trackpool(remove_path, tmps, "Removing temporary files")
+    for f in tmps:
+        console.print(
+            f"Removed {f.relative_to(PATH)}",
+            style="bright_black",
+        )
+    console.print(f"Reclaimed {decimal(sum(sizes))}", style="bright_black")
 
 
-@cache
-def check_pr_closed(repo, no) -> bool:
-    # Use API
+def query_closed(repo: str, numbers: list[str]) -> dict[str, bool]:
+    """Check if issues or PRs of a repo are closed or merged in one GraphQL query."""
     org = "bokeh" if repo == "bokeh" else "holoviz"
-    url = f"https://api.github.com/repos/{org}/{repo}/issues/{no}"
-    resp = httpx.get(url, headers=HEADERS)
-    with suppress(httpx.HTTPError):
-        tag = resp.raise_for_status().json()["state"]
-        return tag in ["closed", "merged"]
-
-    # Else Web-Scraping
-    url = f"https://github.com/holoviz/{repo}/issues/{no}"
-    resp = httpx.get(url, follow_redirects=True).raise_for_status()
-
-    soup = BeautifulSoup(resp.text, features="html.parser")
-    tag = soup.find(class_="State").text.strip().lower()
-    return tag in ["closed", "merged"]
-
-
-def archive() -> None:
+    fragment = "{ ... on Issue { state } ... on PullRequest { state } }"
+    aliases = " ".join(
+        f"n{no}: issueOrPullRequest(number: {int(no)}) {fragment}" for no in numbers
+    )
+    query = f'{{ repository(owner: "{org}", name: "{repo}") {{ {aliases} }} }}'
+    resp = httpx.post(
+        "https://api.github.com/graphql", json={"query": query}, headers=HEADERS, timeout=60
+    ).raise_for_status()
+    # Unknown numbers are reported as errors next to the partial data
+    items = (resp.json().get("data") or {}).get("repository") or {}
+    return {no: (items.get(f"n{no}") or {}).get("state") in ["CLOSED", "MERGED"] for no in numbers}
+
+
+def load_states() -> dict[str, dict]:
+    if not STATES_FILE.exists():
+        return {}
+    return json.loads(STATES_FILE.read_text())
+
+
+def check_closed(checks: list[tuple[str, str]], recheck: float) -> dict[tuple[str, str], bool]:
+    """
+    Check if issues or PRs are closed, batching GRAPHQL_BATCH numbers per query.
+
+    Closed items are stored and never checked again, open items are checked
+    again when they were last checked more than recheck hours ago.
+    """
+    states, now = load_states(), time.time()
+    numbers = defaultdict(set)
+    for repo, no in checks:
+        state = states.get(f"{repo}#{no}")
+        if state is None or (not state["closed"] and now - state["checked_at"] > recheck * 3600):
+            numbers[repo].add(no)
+    batches = [
+        (repo, nos[i : i + GRAPHQL_BATCH])
+        for repo, repo_nos in numbers.items()
+        for nos in [sorted(repo_nos, key=int)]
+        for i in range(0, len(nos), GRAPHQL_BATCH)
+    ]
+    results = trackpool(lambda x: query_closed(*x), batches, "Checking files")
+    for (repo, _), res in zip(batches, results, strict=True):
+        for no, closed in res.items():
+            states[f"{repo}#{no}"] = {"closed": closed, "checked_at": now}
+    if batches:
+        STATES_FILE.write_text(json.dumps(states, indent=2))
+    return {(repo, no): states[f"{repo}#{no}"]["closed"] for repo, no in checks}
+
+
+def load_index(archive_path: Path) -> dict[str, str]:
+    index_file = archive_path / "index.json"
+    return json.loads(index_file.read_text()) if index_file.exists() else {}
+
+
+def bundle(repo_path: Path, paths: list[Path]) -> Path:
+    """
+    Move paths into the bundle of the current month in the archive of a repo,
+    recording the bundle of each item in the index.json of the archive.
+    """
+    archive_path = repo_path / "archive"
+    archive_path.mkdir(exist_ok=True)
+    bundle_file = archive_path / f"{datetime.now():%Y-%m}.tar.zst"
+    # Compressed tar files can't be appended to, so the bundle is rewritten
+    tmp_file = bundle_file.with_name(f".{bundle_file.name}.tmp")
+    with tarfile.open(tmp_file, "w:zst") as out:
+        if bundle_file.exists():
+            with tarfile.open(bundle_file, "r|zst") as old:
+                for member in old:
+                    out.addfile(member, old.extractfile(member) if member.isfile() else None)
+        for path in paths:
+            out.add(path, arcname=path.name)
+    tmp_file.replace(bundle_file)
+
+    index = load_index(archive_path)
+    for path in paths:
+        index[path.name] = bundle_file.name
+        if path.is_dir():
+            rmtree(path)
+        else:
+            path.unlink()
+    (archive_path / "index.json").write_text(json.dumps(index, indent=2))
+    return bundle_file
+
+
+def list_archive() -> None:
+    for archive_path in sorted(PATH.glob("dev_*/archive")):
+        for name, bundle_name in sorted(load_index(archive_path).items()):
+            console.print(f"{archive_path.relative_to(PATH)}/{bundle_name}: {name}")
+
+
+def extract(name: str) -> None:
+    """Extract an item from its bundle into the archive, without unpacking the rest."""
+    found = False
+    for archive_path in sorted(PATH.glob("dev_*/archive")):
+        bundle_name = load_index(archive_path).get(name)
+        if bundle_name is None:
+            continue
+        with tarfile.open(archive_path / bundle_name, "r|zst") as tar:
+            for member in tar:
+                if member.name == name or member.name.startswith(f"{name}/"):
+                    tar.extract(member, archive_path, filter="data")
+        console.print(f"Extracted {(archive_path / name).relative_to(PATH)}")
+        found = True
+    if not found:
+        console.print(f"{name} not found in any archive index", style="red")
+
+
+def archive(recheck: float = 24, compress: bool = False) -> None:
     repos = sorted(PATH.glob("dev_*"))
 
     checks, srcs, dsts = [], [], []
@@ -106,21 +234,78 @@ def archive() -> None:
             srcs.append(path)
             dsts.append(repo_path / "archive" / path.relative_to(repo_path))
 
-    futures = trackpool(lambda x: check_pr_closed(*x), checks, "Checking files")
+    closed = check_closed(checks, recheck)
 
-    for closed, (repo, no), src, dst in zip(futures, checks, srcs, dsts, strict=True):
-        if closed:
-            dst.parent.mkdir(exist_ok=True)
-            move(src, dst)
+    bundles = defaultdict(list)
+    for (repo, no), src, dst in zip(checks, srcs, dsts, strict=True):
+        if closed[repo, no]:
+            if compress:
+                bundles[src.parent].append(src)
+            else:
+                dst.parent.mkdir(exist_ok=True)
+                move(src, dst)
             console.print(
                 f"{repo} #{no} closed, archiving {src.relative_to(PATH)}",
                 style="bright_black",
             )
 
+    for repo_path, paths in bundles.items():
+        bundle_file = bundle(repo_path, paths)
+        console.print(
+            f"Added {len(paths)} items to {bundle_file.relative_to(PATH)}", style="bright_black"
+        )
+
+
+def clean_notebook(path: Path, known_hash: str | None) -> tuple[bool | None, list | None]:
+    """
+    Strip the outputs and execution counts of a notebook, returning if it
+    was changed and its (mtime, size, hash) afterwards, or None for both
+    if it could not be read as a notebook.
+    """
+    content = path.read_bytes()
+    digest = sha256(content).hexdigest()
+    changed = False
+    if digest != known_hash:
+        try:
+            notebook = json.loads(content)
+            for cell in notebook["cells"]:
+                if cell["cell_type"] == "code" and (cell["outputs"] or cell["execution_count"]):
+                    cell["outputs"], cell["execution_count"] = [], None
+                    changed = True
+        except ValueError, KeyError:
+            return None, None
+        if changed:
+            content = (json.dumps(notebook, indent=1, ensure_ascii=False) + "\n").encode()
+            path.write_bytes(content)
+            digest = sha256(content).hexdigest()
+    stat = path.stat()
+    return changed, [stat.st_mtime_ns, stat.st_size, digest]
+
 
 def clean_notebooks() -> None:
-    output = check_output(["clean-notebook", "-s", "."], cwd=PATH)
-    console.print(output.decode(), style="bright_black")
+    index = json.loads(NOTEBOOKS_FILE.read_text()) if NOTEBOOKS_FILE.exists() else {}
+    notebooks = {}
+    for path in PATH.rglob("*.ipynb"):
+        stat, known = path.stat(), index.get(str(path))
+        unchanged = known and known[:2] == [stat.st_mtime_ns, stat.st_size]
+        notebooks[str(path)] = known if unchanged else None
+
+    pending = [p for p, known in notebooks.items() if known is None]
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(
+            clean_notebook, map(Path, pending), [index.get(p, [None] * 3)[2] for p in pending]
+        )
+        for path, (changed, entry) in zip(pending, results, strict=True):
+            notebooks[path] = entry
+            if changed is None:
+                console.print(f"Skipped {Path(path).relative_to(PATH)}, not a valid notebook")
+            elif changed:
+                console.print(f"Cleaned {Path(path).relative_to(PATH)}", style="bright_black")
+
+    console.print(f"Checked {len(pending)} of {len(notebooks)} notebooks", style="bright_black")
+    # Skipped notebooks are left out, so they are reported again on the next run
+    index = {path: entry for path, entry in notebooks.items() if entry is not None}
+    NOTEBOOKS_FILE.write_text(json.dumps(index, indent=2))
 
 
 def title(msg) -> None:
@@ -129,11 +314,34 @@ def title(msg) -> None:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Clean up the development folder")
+    parser.add_argument(
+        "--recheck",
+        type=float,
+        default=24,
+        help="Hours before an open issue or PR is checked again (default: 24)",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Archive closed issues into monthly .tar.zst bundles per repo",
+    )
+    parser.add_argument("--list", action="store_true", help="List the items in the bundles")
+    parser.add_argument("--extract", metavar="NAME", help="Extract an item from its bundle")
+    args = parser.parse_args()
+
+    if args.list:
+        list_archive()
+        return
+    if args.extract:
+        extract(args.extract)
+        return
+
     title("Removing temporary files and directories")
     remove_temp()
 
     title("Archiving closed issues")
-    archive()
+    archive(args.recheck, args.compress)
 
     title("Cleaning notebooks")
     clean_notebooks()
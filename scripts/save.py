@@ -2,22 +2,24 @@
 
 from __future__ import annotations
 
+import argparse
 import ast
 import json
 import os
 import re
 import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from contextlib import suppress
 from datetime import date
+from html.parser import HTMLParser
 from pathlib import Path
+from textwrap import dedent
 from typing import TypedDict
 
 import httpx
-from bs4 import BeautifulSoup
+import platformdirs
 from pandas.io.clipboard import clipboard_get, clipboard_set
 
-from utilities import exit_print
-
 
 class LanguageInfo(TypedDict):
     name: str
@@ -52,6 +54,16 @@ class Notebook(TypedDict):
 
 
 PATH = Path(os.environ["HOLOVIZ_DEV"]).resolve() / "development"
+CACHE_PATH = platformdirs.user_cache_path() / "holoviz-cli" / "save"
+CACHE_PATH.mkdir(parents=True, exist_ok=True)
+GITHUB_URL = re.compile(r"github\.com/([^/]+)/([^/]+)/(?:issues|pull)/(\d+)")
+# The closing fence may be longer than the opening fence. Any indentation is
+# allowed, as code blocks in list items are indented, and dedented afterwards.
+FENCED_CODE = re.compile(
+    r"^[ \t]*(?P<fence>(?P<char>[`~])(?P=char){2,})[^\n]*\n(?P<code>.*?)"
+    r"^[ \t]*(?P=fence)(?P=char)*[ \t]*$",
+    re.MULTILINE | re.DOTALL,
+)
 
 
 def get_id():
@@ -66,21 +78,73 @@ def main(url):
     save_python(repo, filename, python)
 
 
-def get_code_and_info(url):
+def fetch(url, client=httpx):
     if "github.com" in url:
-        codeblocks, repo, filename = _get_github(url)
+        return _fetch_github(url, client)
     elif "discourse.holoviz.org" in url:
-        codeblocks, repo, filename = _get_discourse(url)
+        return client.get(url + ".json").raise_for_status().json()
     else:
         msg = f"Not valid url: {url}"
         raise ValueError(msg)
 
+
+def get_code_and_info(url, payload=None):
+    if payload is None:
+        payload = fetch(url)
+    if "github.com" in url:
+        codeblocks, repo, filename = _get_github(payload)
+    else:
+        codeblocks, repo, filename = _get_discourse(payload)
+
     codeblocks = sanitize_codeblock(codeblocks)
     assert len(codeblocks) > 0
 
     return codeblocks, repo, filename
 
 
+def existing_notebook(url) -> Path | None:
+    """Return the saved notebook of a URL, found without any request."""
+    if match := GITHUB_URL.search(url):
+        repo, number = f"dev_{match[2]}", match[3]
+    elif match := re.search(r"discourse\.holoviz\.org/t/(?:[^/]+/)?(\d+)", url):
+        repo, number = "discourse", match[1]
+    else:
+        return None
+    return next((PATH / repo).glob(f"{number}_*.ipynb"), None)
+
+
+def batch(urls):
+    pending = []
+    for url in dict.fromkeys(urls):
+        if file := existing_notebook(url):
+            print(f"{url} already saved as {file.relative_to(PATH)}")
+        else:
+            pending.append(url)
+
+    with (
+        httpx.Client(timeout=30) as client,
+        ThreadPoolExecutor(max_workers=16) as fetchers,
+        ProcessPoolExecutor() as parsers,
+    ):
+        fetches = {fetchers.submit(fetch, url, client): url for url in pending}
+        parses = {}
+        for future in as_completed(fetches):
+            url = fetches[future]
+            try:
+                parses[parsers.submit(get_code_and_info, url, future.result())] = url
+            except Exception as e:
+                print(f"{url} failed: {e}")
+        for future in as_completed(parses):
+            url = parses[future]
+            try:
+                codeblocks, repo, filename = future.result()
+            except Exception as e:
+                print(f"{url} failed: {e}")
+                continue
+            save_notebook(repo, filename, create_notebook(codeblocks, url), clipboard=False)
+            save_python(repo, filename, create_python(codeblocks, url))
+
+
 def sanitize_string(s):
     return "".join(x for x in s.strip() if x.isalnum() or x == " ").replace(" ", "_")
 
@@ -89,39 +153,108 @@ def sanitize_codeblock(codeblocks):
     new = []
     for n in codeblocks:
         with suppress(SyntaxError):
-            n = n.text
             ast.parse(n)
             new.append(n)
     return new
 
 
-def _get_github(url):
-    resp = httpx.get(url).raise_for_status()
+def _fetch_github(url, client=httpx):
+    """
+    Fetch an issue and its comments from the REST API, cached on disk.
+
+    The issue is revalidated with its ETag and only comments updated since
+    the cached issue are downloaded.
+    """
+    match = GITHUB_URL.search(url)
+    if match is None:
+        msg = f"Not valid url: {url}"
+        raise ValueError(msg)
+    owner, repo, number = match.groups()
+    api = f"https://api.github.com/repos/{owner}/{repo}/issues/{number}"
+    cache_file = CACHE_PATH / f"{owner}_{repo}_{number}.json"
+    cached = json.loads(cache_file.read_text()) if cache_file.exists() else None
+
+    # Read here, as the token is not needed for Discourse
+    headers = {
+        "Accept": "application/vnd.github+json",
+        "Authorization": f"Bearer {os.environ['GITHUB_TOKEN']}",
+        "X-GitHub-Api-Version": "2022-11-28",
+    }
+    etag_headers = {**headers, "If-None-Match": cached["etag"]} if cached else headers
+    resp = client.get(api, headers=etag_headers)
+    if cached and resp.status_code == httpx.codes.NOT_MODIFIED:
+        return cached
+    issue = resp.raise_for_status().json()
+
+    comments = {c["id"]: c for c in cached["comments"]} if cached else {}
+    params = {"per_page": 100}
+    if cached:
+        params["since"] = cached["issue"]["updated_at"]
+    resp_comments = client.get(f"{api}/comments", headers=headers, params=params)
+    while True:
+        comments.update({c["id"]: c for c in resp_comments.raise_for_status().json()})
+        if not (next_page := resp_comments.links.get("next")):
+            break
+        resp_comments = client.get(next_page["url"], headers=headers)
+
+    data = {
+        "etag": resp.headers.get("ETag"),
+        "issue": issue,
+        "comments": [comments[i] for i in sorted(comments)],
+    }
+    cache_file.write_text(json.dumps(data))
+    return data
 
-    soup = BeautifulSoup(resp.text, features="html.parser")
-    codeblocks = soup.find_all("div", class_={"highlight", "notranslate"})
-    title = soup.find("title")
-    if title is None:
-        exit_print("No title in html")
-    info = title.text.split(" · ")
-    number = info[1].split("#")[1]
-    title = sanitize_string(info[0])
-    repo = "dev_" + info[2].split("/")[1]
+
+def markdown_codeblocks(markdown):
+    markdown = markdown.replace("\r\n", "\n")
+    return [dedent(m["code"]).rstrip("\n") for m in FENCED_CODE.finditer(markdown)]
+
+
+def _get_github(data):
+    issue = data["issue"]
+    bodies = [issue["body"], *(c["body"] for c in data["comments"])]
+    codeblocks = [code for body in bodies if body for code in markdown_codeblocks(body)]
+
+    number = issue["number"]
+    title = sanitize_string(issue["title"])
+    repo = "dev_" + issue["repository_url"].rsplit("/", 1)[1]
     filename = f"{number}_{title}"
 
     return codeblocks, repo, filename
 
 
-def _get_discourse(url):
-    url = url + ".json"
-    resp = httpx.get(url).raise_for_status()
+class CodeParser(HTMLParser):
+    """Collect the text of elements with a lang-* class, like Discourse code blocks."""
+
+    def __init__(self):
+        super().__init__()
+        self.codeblocks = []
+        self._tag, self._depth, self._data = None, 0, []
+
+    def handle_starttag(self, tag, attrs):
+        if self._depth:
+            self._depth += tag == self._tag
+        elif "lang-" in (dict(attrs).get("class") or ""):
+            self._tag, self._depth, self._data = tag, 1, []
 
-    data = resp.json()
-    regex = re.compile("lang-")
+    def handle_endtag(self, tag):
+        if self._depth and tag == self._tag:
+            self._depth -= 1
+            if not self._depth:
+                self.codeblocks.append("".join(self._data))
+
+    def handle_data(self, data):
+        if self._depth:
+            self._data.append(data)
+
+
+def _get_discourse(data):
     codeblocks = []
     for post in data["post_stream"]["posts"]:
-        soup = BeautifulSoup(post["cooked"], features="html.parser")
-        codeblocks.extend(soup.find_all(True, class_=regex))
+        parser = CodeParser()
+        parser.feed(post["cooked"])
+        codeblocks.extend(parser.codeblocks)
 
     number = data["id"]
     title = sanitize_string(data["title"])
@@ -193,7 +326,7 @@ def link(uri, label=None, parameters=None):
     return escape_mask.format(parameters, uri, label)
 
 
-def save_notebook(repo, filename, notebook):
+def save_notebook(repo, filename, notebook, clipboard=True):
     repo_path = PATH / repo
     repo_path.mkdir(exist_ok=True)
     file = repo_path / f"{filename}.ipynb"
@@ -201,7 +334,8 @@ def save_notebook(repo, filename, notebook):
     here_url = (
         f"http://localhost:8888/lab/workspaces/auto-W/tree/development/{repo}/{filename}.ipynb"
     )
-    clipboard_set(here_url)
+    if clipboard:
+        clipboard_set(here_url)
     here_url = link(here_url, "here")
 
     if file.exists():
@@ -230,5 +364,19 @@ def save_python(repo, filename, python):
 
 
 if __name__ == "__main__":
-    url = clipboard_get()
-    main(url)
+    parser = argparse.ArgumentParser(description="Save the code of an issue or discourse post")
+    parser.add_argument(
+        "--batch",
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help="Save every URL in FILE, or stdin if no file is given, instead of the clipboard URL",
+    )
+    args = parser.parse_args()
+
+    if args.batch:
+        with open(0 if args.batch == "-" else args.batch) as f:
+            batch([line.strip() for line in f if line.strip()])
+    else:
+        url = clipboard_get()
+        main(url)
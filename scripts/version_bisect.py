@@ -2,18 +2,36 @@ from __future__ import annotations
 
 import json
 import os
+import platform
+import re
 import subprocess
 import sys
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from functools import cache
 from hashlib import sha256
 from pathlib import Path
+from threading import Lock
 
+import platformdirs
 import rich_click as click
 from rich.console import Console
+from rich.table import Table
+
+from utilities import git
 
 console = Console()
 ts = str(int(time.time()))
+CACHE_PATH = platformdirs.user_cache_path() / "holoviz-cli" / "version_bisect"
+CACHE_PATH.mkdir(parents=True, exist_ok=True)
+RESULTS_FILE = CACHE_PATH / "results.json"
+RESULTS_LOCK = Lock()
+POOL_FILE = CACHE_PATH / "pool.json"
+POOL_LOCK = Lock()
+# Names of the environments created by version_bisect
+ENV_PATTERN = re.compile(r"tmp_(git_)?[0-9a-f]{64}")
+PLATFORM = f"{sys.platform}-{platform.machine()}"
 
 # TODO
 # - Allow to ignore a version
@@ -35,9 +53,139 @@ def conda_envs():
     return [os.path.basename(e) for e in info["envs"]]
 
 
-def run_in_shell(script: str, log_file: Path) -> bool:
+@cache
+def load_pool() -> dict[str, dict]:
+    if not POOL_FILE.exists():
+        return {}
+    return json.loads(POOL_FILE.read_text())
+
+
+def update_pool(env_name: str, constraints: list[str] | None) -> None:
+    """Record the last use of an environment, or remove it with constraints=None."""
+    with POOL_LOCK:
+        pool = load_pool()
+        if constraints is None:
+            pool.pop(env_name, None)
+        else:
+            pool[env_name] = {"constraints": constraints, "last_used": time.time()}
+        POOL_FILE.write_text(json.dumps(pool, indent=2))
+
+
+def clone_source(constraints: list[str]) -> str | None:
+    """
+    Return the most recently used environment with the same dependencies,
+    skipping the environments with an editable install for --git.
+    """
+    envs = conda_envs()
+    # Copied under the lock, as other threads may update the pool meanwhile
+    with POOL_LOCK:
+        pool = dict(load_pool())
+    candidates = [
+        (info["last_used"], name)
+        for name, info in pool.items()
+        if info["constraints"][1:] == constraints[1:]
+        and name in envs
+        and not name.startswith("tmp_git_")
+    ]
+    return max(candidates)[1] if candidates else None
+
+
+def create_env(env_name: str, constraints: list[str], log_file: Path, clone: bool = True) -> bool:
+    """
+    Create an environment, cloning an environment with the same dependencies
+    and only installing the changed package into it if possible.
+    """
     with open(log_file, "a") as log:
-        result = subprocess.run(["bash", "-c", script], stdout=log, stderr=log, check=False)
+
+        def run(*cmd: str) -> bool:
+            return subprocess.run(cmd, stdout=log, stderr=log, check=False).returncode == 0
+
+        source = clone_source(constraints) if clone else None
+        if source:
+            log.write(f"  Cloning environment: {source} -> {env_name}\n")
+            cloned = run("conda", "create", "-y", "-n", env_name, "--clone", source, "--offline")
+            if cloned and run(
+                "mamba", "install", "-y", "-n", env_name, constraints[0], "--offline"
+            ):
+                conda_envs.cache_clear()
+                return True
+            run("mamba", "env", "remove", "-y", "-n", env_name)
+
+        log.write(f"  Creating environment: {env_name}\n")
+        created = run("mamba", "create", "-y", "-n", env_name, *constraints, "--offline")
+    conda_envs.cache_clear()
+    return created
+
+
+def remove_old_envs(max_envs: int) -> None:
+    """Remove the least recently used bisection environments above max_envs."""
+    with POOL_LOCK:
+        pool = dict(load_pool())
+    envs = sorted(
+        (e for e in conda_envs() if e in pool or ENV_PATTERN.fullmatch(e)),
+        key=lambda e: pool.get(e, {}).get("last_used", 0),
+    )
+    old = envs[: max(len(envs) - max_envs, 0)]
+    for env_name in old:
+        console.print(f"[bright_black]    Removing old environment {env_name}[/bright_black]")
+        subprocess.run(
+            ["mamba", "env", "remove", "-y", "-n", env_name], check=False, capture_output=True
+        )
+        update_pool(env_name, None)
+    if old:
+        conda_envs.cache_clear()
+
+
+@cache
+def load_results() -> dict[str, bool]:
+    if not RESULTS_FILE.exists():
+        return {}
+    return json.loads(RESULTS_FILE.read_text())
+
+
+def store_result(key: str, passed: bool) -> None:
+    with RESULTS_LOCK:
+        results = load_results()
+        results[key] = passed
+        RESULTS_FILE.write_text(json.dumps(results, indent=2))
+
+
+@cache
+def test_fingerprint(test_command: str) -> str:
+    if os.path.exists(test_command):
+        return sha256(Path(test_command).read_bytes()).hexdigest()
+    return sha256(test_command.encode()).hexdigest()
+
+
+def result_key(ev: str, test_command: str) -> str:
+    """Key of a test result, changing with the constraints, the test and the platform."""
+    return f"{ev}-{test_fingerprint(test_command)}-{PLATFORM}"
+
+
+@cache
+def activation_env(env_name: str, conda_sh: Path) -> dict[str, str]:
+    """Return the environment variables of an activated conda environment."""
+    script = f'source "{conda_sh}" && conda activate {env_name} && env -0'
+    result = subprocess.run(["bash", "-c", script], capture_output=True, check=True)
+    return dict(v.split("=", 1) for v in result.stdout.decode().split("\0") if "=" in v)
+
+
+def run_test(
+    env: dict[str, str], test_command: str, log_file: Path, timeout: float | None = None
+) -> bool | None:
+    """Run the test with the environment's interpreter, returning None on timeout."""
+    python = Path(env["CONDA_PREFIX"]) / "bin" / "python"
+    args = [python, test_command] if os.path.exists(test_command) else [python, "-c", test_command]
+    with open(log_file, "a") as log:
+        start = time.perf_counter()
+        try:
+            result = subprocess.run(
+                args, env=env, stdout=log, stderr=log, timeout=timeout, check=False
+            )
+        except subprocess.TimeoutExpired:
+            log.write(f"  Test timed out after {timeout}s\n")
+            return None
+        log.write(f"  Test took {time.perf_counter() - start:.2f}s\n")
     return result.returncode == 0
 
 
@@ -48,33 +196,188 @@ def version_check(
     conda_sh: Path,
     log_file: Path,
     deps: tuple[str, ...] = (),
+    rerun: bool = False,
+    timeout: float | None = None,
+    clone: bool = True,
 ) -> bool:
     constraints = [f"{pkg}={version}"]
     constraints.extend(deps)
     constraints_str = " ".join(constraints)
     ev = sha256(constraints_str.encode()).hexdigest()
+    key = result_key(ev, test_command)
+    if not rerun and key in load_results():
+        with open(log_file, "a") as log:
+            log.write(f"  Using stored result for: {constraints_str}\n")
+        return load_results()[key]
+
     env_name = f"tmp_{ev}"
-    if env_name not in conda_envs():
+    if env_name not in conda_envs() and not create_env(env_name, constraints, log_file, clone):
+        return False
+    update_pool(env_name, constraints)
+
+    try:
+        env = activation_env(env_name, conda_sh)
+    except subprocess.CalledProcessError:
+        return False
+
+    passed = run_test(env, test_command, log_file, timeout)
+    if passed is None:
+        # A timeout depends on the --timeout used, so it is not stored
+        return False
+    store_result(key, passed)
+    return passed
+
+
+def editable_install(env: dict[str, str], package: str, worktree: Path, log_file: Path) -> bool:
+    """Install the worktree in editable mode, unless it already is."""
+    python = Path(env["CONDA_PREFIX"]) / "bin" / "python"
+    script = (
+        "import sys; from importlib.metadata import distribution; "
+        "print(distribution(sys.argv[1]).read_text('direct_url.json') or '{}')"
+    )
+
+    def installed() -> bool:
+        result = subprocess.run(
+            [python, "-c", script, package], env=env, capture_output=True, check=False
+        )
+        if result.returncode != 0:
+            return False
+        direct_url = json.loads(result.stdout)
+        editable = direct_url.get("dir_info", {}).get("editable", False)
+        return editable and direct_url.get("url") == worktree.resolve().as_uri()
+
+    if installed():
+        return True
+    with open(log_file, "a") as log:
+        subprocess.run(
+            [python, "-m", "pip", "install", "--no-deps", "-e", worktree],
+            env=env,
+            stdout=log,
+            stderr=log,
+            check=False,
+        )
+    return installed()
+
+
+def release_commit(repo: Path, version: str) -> str:
+    for tag in (f"v{version}", version):
+        try:
+            return git("-C", repo, "rev-parse", "--verify", "--quiet", f"{tag}^{{commit}}")
+        except subprocess.CalledProcessError:
+            continue
+    console.print(f"[red]Error:[/red] No tag for {version} found in {repo}.")
+    sys.exit(1)
+
+
+def git_bisect(
+    package: str,
+    old_version: str,
+    new_version: str,
+    test_command: str,
+    conda_sh: Path,
+    log_file: Path,
+    deps: tuple[str, ...] = (),
+    rerun: bool = False,
+    timeout: float | None = None,
+) -> None:
+    """
+    Bisect the commits between two releases of a package in $HOLOVIZ_REP,
+    following the first-parent history from their merge base.
+
+    The commits are checked out in a worktree which is installed in editable
+    mode into a single environment, so each step only runs the test.
+    """
+    repo = Path(os.environ["HOLOVIZ_REP"]) / package
+    old, new = release_commit(repo, old_version), release_commit(repo, new_version)
+
+    worktree = CACHE_PATH / "worktrees" / package
+    if not worktree.exists():
+        git("-C", repo, "worktree", "prune")
+        git("-C", repo, "worktree", "add", "--detach", worktree, old)
+
+    constraints = [f"{package}={old_version}", *deps]
+    ev = sha256(" ".join(constraints).encode()).hexdigest()
+    env_name = f"tmp_git_{ev}"
+    if env_name not in conda_envs() and not create_env(env_name, constraints, log_file):
+        console.print(f"[red]    Could not create environment {env_name}. Exiting.[/red]")
+        sys.exit(1)
+    env = activation_env(env_name, conda_sh)
+    if not editable_install(env, package, worktree, log_file):
+        subprocess.run(
+            ["mamba", "env", "remove", "-y", "-n", env_name], check=False, capture_output=True
+        )
+        update_pool(env_name, None)
+        conda_envs.cache_clear()
+        console.print(
+            f"[red]    Could not install {worktree} in editable mode, see {log_file}. Exiting.[/red]"
+        )
+        sys.exit(1)
+    update_pool(env_name, constraints)
+
+    def check(commit: str) -> bool:
+        key = result_key(sha256(f"{commit} {' '.join(deps)}".encode()).hexdigest(), test_command)
+        if not rerun and key in load_results():
+            return load_results()[key]
+        git("-C", worktree, "checkout", "--quiet", "--detach", commit)
         with open(log_file, "a") as log:
-            log.write(f"  Creating environment: {env_name}\n")
-            result = subprocess.run(
-                ["mamba", "create", "-y", "-n", env_name, *constraints, "--offline"],
-                stdout=log,
-                stderr=log,
-                check=False,
+            log.write(f"  Testing commit: {commit}\n")
+        passed = run_test(env, test_command, log_file, timeout)
+        if passed is None:
+            return False
+        store_result(key, passed)
+        return passed
+
+    old_passed, new_passed = check(old), check(new)
+    result = {True: "[green]passed[/green]", False: "[red]failed[/red]"}
+    console.print(f"    {old_version} {result[old_passed]}, {new_version} {result[new_passed]}")
+    if old_passed == new_passed:
+        console.print(
+            "[red]    Both releases give the same result when built from source. Exiting.[/red]"
+        )
+        sys.exit(1)
+
+    # Releases tagged on a backport branch are not ancestors of the next
+    # release, so like git bisect, the search starts from the merge base
+    start = git("-C", repo, "merge-base", old, new)
+    if start != old:
+        short = git("-C", repo, "log", "-1", "--format=%h %s", start)
+        console.print(f"    {old_version} is not an ancestor of {new_version}, using {short}")
+        if check(start) != old_passed:
+            console.print(
+                f"[red]    The merge base gives another result than {old_version}, "
+                "so the change is on the branch of the release. Exiting.[/red]"
             )
-            if result.returncode != 0:
-                return False
+            sys.exit(1)
+
+    commits = git(
+        "-C", repo, "rev-list", "--first-parent", "--ancestry-path", "--reverse", f"{start}..{new}"
+    ).split()
+    if git("-C", repo, "rev-parse", f"{commits[0]}^") != start:
+        console.print(
+            f"[red]    {start[:7]} is not on the first-parent history of {new_version}. Exiting.[/red]"
+        )
+        sys.exit(1)
+    console.print(
+        f"[green]    Found {len(commits)} commits between {old_version} and {new_version}[/green]"
+    )
+
+    left, right = -1, len(commits) - 1
+    while right - left > 1:
+        mid = (left + right) // 2
+        commit = commits[mid]
+        console.print(
+            f"    Testing {git('-C', repo, 'log', '-1', '--format=%h %s', commit)}...", end=""
+        )
+        passed = check(commit)
+        console.print("[green] passed[/green]" if passed else "[red] failed[/red]")
+        if passed == old_passed:
+            left = mid
+        else:
+            right = mid
 
-    c = "" if os.path.exists(test_command) else "-c"
-    script = f"""
-        source "{conda_sh}"
-        conda activate {env_name}
-        python {c} "{test_command}"
-        rc=$?
-        conda deactivate
-        exit $rc"""
-    return run_in_shell(script, log_file)
+    change = "failing" if old_passed else "passing"
+    summary = git("-C", repo, "log", "-1", "--format=%H%n    %an, %ad%n    %s", commits[right])
+    console.print(f"[yellow]    First {change} commit is: {summary}[/yellow]")
 
 
 def get_all_package_versions(package):
@@ -90,6 +393,138 @@ def get_all_package_versions(package):
     return all_versions
 
 
+def split_points(left: int, right: int, jobs: int) -> list[int]:
+    """Return up to jobs - 1 points splitting the open interval (left, right) evenly."""
+    points = {left + (right - left) * i // jobs for i in range(1, jobs)}
+    return sorted(p for p in points if left < p < right)
+
+
+def bisect_versions(versions: list[str], check, jobs: int = 2) -> int:
+    """
+    Return the index of the first failing version, where versions[0] passes
+    and versions[-1] fails.
+
+    Each round tests jobs - 1 versions concurrently, reducing the number of
+    sequential rounds from log2(n) to log_jobs(n).
+    """
+    left, right = 0, len(versions) - 1
+    with ThreadPoolExecutor(max_workers=jobs - 1) as executor:
+        while right - left > 1:
+            points = split_points(left, right, jobs)
+            tested = [versions[p] for p in points]
+            with console.status(f"Testing {', '.join(tested)}..."):
+                outcome = dict(zip(points, executor.map(check, tested), strict=True))
+            for point, passed in outcome.items():
+                console.print(f"    Testing {versions[point]}...", end="")
+                console.print("[green] passed[/green]" if passed else "[red] failed[/red]")
+
+            right = min((p for p, passed in outcome.items() if not passed), default=right)
+            left = max((p for p, passed in outcome.items() if passed and p < right), default=left)
+    return right
+
+
+def bisect_grid(rows: list[str], columns: list[str], check, jobs: int = 2) -> list[int]:
+    """
+    Return the index of the first failing row for each column, len(rows) if
+    none fails, where a failure at (row, column) implies failures at all
+    later rows and columns.
+
+    The middle column of each unresolved range of columns is bisected
+    between the boundaries of its neighbours, so every resolved column
+    narrows the search for the remaining ones. Like bisect_versions, each
+    round tests jobs - 1 rows of every middle column, all concurrently.
+    """
+    frontier = [len(rows)] * len(columns)
+    # Column ranges (first, last) with bounds (lo, hi) on their first failing row
+    ranges = [(0, len(columns) - 1, 0, len(rows))]
+    with ThreadPoolExecutor(max_workers=jobs - 1) as executor:
+        while ranges:
+            # The last known passing and first known failing row of each middle column
+            searches = {(first + last) // 2: [lo - 1, hi] for first, last, lo, hi in ranges}
+            while active := [
+                (col, row)
+                for col, (left, right) in searches.items()
+                for row in split_points(left, right, jobs)
+            ]:
+                tested = [(rows[row], columns[col]) for col, row in active]
+                label = ", ".join(f"{r} x {c}" for r, c in tested)
+                with console.status(f"Testing {label}..."):
+                    results = list(executor.map(lambda rc: check(*rc), tested))
+                outcome = defaultdict(dict)
+                for (col, row), (r, c), passed in zip(active, tested, results, strict=True):
+                    console.print(f"    Testing {r} x {c}...", end="")
+                    console.print("[green] passed[/green]" if passed else "[red] failed[/red]")
+                    outcome[col][row] = passed
+                for col, col_outcome in outcome.items():
+                    left, right = searches[col]
+                    right = min(
+                        (r for r, passed in col_outcome.items() if not passed), default=right
+                    )
+                    left = max(
+                        (r for r, passed in col_outcome.items() if passed and r < right),
+                        default=left,
+                    )
+                    searches[col] = [left, right]
+
+            next_ranges = []
+            for first, last, lo, hi in ranges:
+                mid = (first + last) // 2
+                frontier[mid] = searches[mid][1]
+                if first < mid:
+                    next_ranges.append((first, mid - 1, frontier[mid], hi))
+                if mid < last:
+                    next_ranges.append((mid + 1, last, lo, frontier[mid]))
+            ranges = next_ranges
+    return frontier
+
+
+def version_range(all_versions: list[str], good_version: str, bad_version: str) -> list[str]:
+    """Return the versions from good_version to bad_version, exiting if either is unknown."""
+    for version in (good_version, bad_version):
+        if version not in all_versions:
+            console.print(f"[red]Error:[/red] {version} not found in available versions.")
+            sys.exit(1)
+    g_idx, b_idx = all_versions.index(good_version), all_versions.index(bad_version)
+    if g_idx < b_idx:
+        return all_versions[g_idx : b_idx + 1]
+    return all_versions[b_idx : g_idx + 1][::-1]
+
+
+def bisect_against(versions: list[str], against: tuple[str, str, str], check, jobs: int) -> None:
+    """Find and print the failing frontier of versions against a dependency range."""
+    dep, dep_good, dep_bad = against
+    dep_versions = version_range(get_all_package_versions(dep), dep_good, dep_bad)
+    console.print(
+        f"[green]    Found {len(dep_versions)} versions of {dep} between {dep_good} and {dep_bad}[/green]"
+    )
+
+    console.print("[yellow][+] Verifying baseline versions[/yellow]")
+    if not check(versions[0], dep_versions[0]):
+        console.print(
+            f"[red]    {versions[0]} x {dep_versions[0]} failed. It must pass. Exiting.[/red]"
+        )
+        sys.exit(1)
+    if check(versions[-1], dep_versions[-1]):
+        console.print(
+            f"[red]    {versions[-1]} x {dep_versions[-1]} passed. It must fail. Exiting.[/red]"
+        )
+        sys.exit(1)
+
+    console.print("[yellow][+] Starting grid bisection[/yellow]")
+    frontier = bisect_grid(versions, dep_versions, check, jobs)
+
+    console.print("[yellow][+] Done[/yellow]")
+    table = Table(title=f"Failing frontier against {dep}")
+    table.add_column(dep)
+    table.add_column("Last passing")
+    table.add_column("First failing")
+    for dep_version, row in zip(dep_versions, frontier, strict=True):
+        passing = versions[row - 1] if row else "-"
+        failing = versions[row] if row < len(versions) else "-"
+        table.add_row(dep_version, f"[green]{passing}[/green]", f"[red]{failing}[/red]")
+    console.print(table)
+
+
 @click.command()
 @click.argument("package")
 @click.argument("good_version")
@@ -100,8 +535,57 @@ def get_all_package_versions(package):
     multiple=True,
     help="Additional dependencies to install (format: package=version or package)",
 )
+@click.option(
+    "--jobs",
+    default=2,
+    type=click.IntRange(min=2),
+    help="Split each round into this many parts, building and testing the environments concurrently",
+)
+@click.option(
+    "--against",
+    nargs=3,
+    metavar="DEP GOOD BAD",
+    help="Bisect the grid of PACKAGE versions against a range of versions of a dependency",
+)
+@click.option(
+    "--git",
+    "git_commits",
+    is_flag=True,
+    help="Continue bisecting the commits between the two releases in $HOLOVIZ_REP",
+)
+@click.option(
+    "--rerun/--no-rerun",
+    default=False,
+    help="Rerun the tests of versions with a stored result",
+)
+@click.option(
+    "--timeout",
+    type=float,
+    help="Seconds before a test is stopped and counted as failed",
+)
+@click.option(
+    "--clone/--no-clone",
+    default=True,
+    help="Create environments by cloning one with the same dependencies",
+)
+@click.option(
+    "--max-envs",
+    default=20,
+    help="Maximum number of environments created by version_bisect to keep, removing the least recently used",
+)
 def cli(
-    package: str, good_version: str, bad_version: str, test_command: str, deps: tuple[str, ...]
+    package: str,
+    good_version: str,
+    bad_version: str,
+    test_command: str,
+    deps: tuple[str, ...],
+    jobs: int,
+    against: tuple[str, str, str] | None,
+    git_commits: bool,
+    rerun: bool,
+    timeout: float | None,
+    clone: bool,
+    max_envs: int,
 ):
     """
     Bisect a conda package version range to find the first failing version.
@@ -113,42 +597,59 @@ def cli(
 
     Use --deps to specify additional dependencies:
       --deps numpy=1.24 --deps scipy
+
+    Use --jobs to test several versions in each round:
+      --jobs 4
+
+    Use --against to find the failing frontier against a dependency range:
+      --against bokeh 3.4.0 3.6.0
+
+    Use --git to find the commit between the two releases:
+      --git
     """
+    if against and git_commits:
+        msg = "--git can't be combined with --against"
+        raise click.UsageError(msg)
+
     log_file = log_path(package)
     conda_info = load_conda_info()
     conda_sh = Path(conda_info["base environment"]) / "etc" / "profile.d" / "conda.sh"
 
+    remove_old_envs(max_envs)
     all_versions = get_all_package_versions(package)
 
-    try:
-        g_idx = all_versions.index(good_version)
-    except ValueError:
-        console.print(f"[red]Error:[/red] {good_version} not found in available versions.")
-        sys.exit(1)
-    try:
-        b_idx = all_versions.index(bad_version)
-    except ValueError:
-        console.print(f"[red]Error:[/red] {bad_version} not found in available versions.")
-        sys.exit(1)
-
-    if g_idx < b_idx:
-        versions = all_versions[g_idx : b_idx + 1]
-    else:
-        versions = all_versions[b_idx : g_idx + 1][::-1]
-
+    versions = version_range(all_versions, good_version, bad_version)
     console.print(
         f"[green]    Found {len(versions)} versions between {good_version} and {bad_version}[/green]"
     )
 
+    def check(version: str, dep: str | None = None) -> bool:
+        return version_check(
+            package,
+            version,
+            test_command,
+            conda_sh,
+            log_file,
+            (*deps, f"{against[0]}={dep}") if dep else deps,
+            rerun,
+            timeout,
+            clone,
+        )
+
+    if against:
+        bisect_against(versions, against, check, jobs)
+        remove_old_envs(max_envs)
+        return
+
     # Step 2: Verify known good
     console.print("[yellow][+] Verifying baseline versions[/yellow]")
-    if version_check(package, good_version, test_command, conda_sh, log_file, deps):
+    if check(good_version):
         console.print(f"[green]    {good_version} passed[/green]")
     else:
         console.print(f"[red]    {good_version} failed. It must pass. Exiting.[/red]")
         sys.exit(1)
 
-    if version_check(package, bad_version, test_command, conda_sh, log_file, deps):
+    if check(bad_version):
         console.print(f"[red]    {bad_version} passed. It must fail. Exiting.[/red]")
         sys.exit(1)
     else:
@@ -156,29 +657,34 @@ def cli(
 
     # Step 3: Bisect
     console.print("[yellow][+] Starting bisection[/yellow]")
-    left, right = 0, len(versions) - 1
-
-    while right - left > 1:
-        mid = (left + right) // 2
-        ver = versions[mid]
-        console.print(f"    Testing {ver}...", end="")
-        if version_check(package, ver, test_command, conda_sh, log_file, deps):
-            console.print("[green] passed[/green]")
-            left = mid
-        else:
-            console.print("[red] failed[/red]")
-            right = mid
+    right = bisect_versions(versions, check, jobs)
 
     problem = versions[right]
     no_problem = versions[right - 1]
+    remove_old_envs(max_envs)
     console.print("[yellow][+] Done[/yellow]")
-    if g_idx < b_idx:
+    if versions[0] == good_version:
         console.print(f"[red]    First failing version is: {problem}[/red]")
         console.print(f"[green]    Last passing version is:  {no_problem}[/green]")
     else:
         console.print(f"[red]    Last failing version is:  {problem}[/red]")
         console.print(f"[green]    First passing version is: {no_problem}[/green]")
 
+    if git_commits:
+        console.print("[yellow][+] Starting commit bisection[/yellow]")
+        old_version, new_version = sorted((problem, no_problem), key=all_versions.index)
+        git_bisect(
+            package,
+            old_version,
+            new_version,
+            test_command,
+            conda_sh,
+            log_file,
+            deps,
+            rerun,
+            timeout,
+        )
+
 
 if __name__ == "__main__":
     cli()
@@ -17,30 +17,42 @@ Spec 0:
 
 from __future__ import annotations
 
+import asyncio
 import collections
+import csv
+import json
 import os
+import time
+from compression import zstd
 from contextlib import suppress
 from datetime import datetime, timedelta
-from functools import cache
+from functools import cache, partial
+from hashlib import sha256
+from importlib.util import find_spec
+from pathlib import Path
 from runpy import run_path
 from tomllib import load
 from typing import Any
 
 import httpx
-from packaging.requirements import Requirement
+import platformdirs
+import rich_click as click
+from packaging.requirements import InvalidRequirement, Requirement
 from packaging.specifiers import SpecifierSet
 from packaging.utils import (
     InvalidSdistFilename,
     InvalidWheelFilename,
+    canonicalize_name,
     parse_sdist_filename,
     parse_wheel_filename,
 )
-from packaging.version import Version
+from packaging.version import InvalidVersion, Version
 from rich.console import Console
+from rich.progress import Progress
 from rich.prompt import Prompt
 from rich.table import Table
 
-from utilities import exit_print, trackpool
+from utilities import exit_print
 
 py_releases = {
     # "3.8": datetime(2019, 10, 14),
@@ -80,27 +92,199 @@ conda_mapping = {
 }
 spec_drop_date = datetime.today() - timedelta(days=365 * 2)
 HEADERS = {"Accept": "application/vnd.pypi.simple.v1+json"}
+PYPI_URL = "https://pypi.org"
+BATCH_FIELDS = ["main_package", "python", "package", "minimum", "maximum", "current", "spec0"]
+CACHE_PATH = platformdirs.user_cache_path() / "holoviz-cli" / "version_finder"
+CACHE_PATH.mkdir(parents=True, exist_ok=True)
+CACHE_TTL = timedelta(hours=1)
+MAX_CONCURRENCY = 16
+HTTP2 = find_spec("h2") is not None
 console = Console()
+err_console = Console(stderr=True)
+# All responses used in this process, for writing a snapshot
+RESPONSES: dict[str, dict[str, Any]] = {}
+
+
+def cache_paths(url, with_headers) -> tuple[Path, Path]:
+    key = sha256(f"{url}|{with_headers}".encode()).hexdigest()
+    return CACHE_PATH / f"{key}.json.zst", CACHE_PATH / f"{key}.meta.json"
+
+
+def read_cache(url, with_headers) -> tuple[dict[str, Any], dict[str, Any] | None]:
+    """Return the stored metadata and body of a response, if any."""
+    body_file, meta_file = cache_paths(url, with_headers)
+    with suppress(FileNotFoundError, ValueError, zstd.ZstdError):
+        meta = json.loads(meta_file.read_text())
+        return meta, json.loads(zstd.decompress(body_file.read_bytes()))
+    return {}, None
+
+
+def write_cache(url, with_headers, meta, content=None) -> None:
+    body_file, meta_file = cache_paths(url, with_headers)
+    if content is not None:
+        body_file.write_bytes(zstd.compress(content))
+    meta_file.write_text(json.dumps({**meta, "fetched": time.time()}))
+
+
+def request_headers(meta, with_headers) -> dict[str, str]:
+    headers = dict(HEADERS) if with_headers else {}
+    if meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def is_fresh(meta) -> bool:
+    return time.time() - meta.get("fetched", 0) < CACHE_TTL.total_seconds()
+
+
+def is_local(url) -> bool:
+    return not url.startswith(("http://", "https://"))
+
+
+def local_path(url) -> Path:
+    # A local mirror has the same layout as the index, e.g. simple/numpy/index.json
+    return Path(url.removeprefix("file://")) / "index.json"
+
+
+def read_local(url) -> dict[str, Any] | None:
+    with suppress(FileNotFoundError):
+        return json.loads(local_path(url).read_text())
 
 
 @cache
 def get_resp(url, with_headers=True) -> dict[str, Any] | None:
-    headers = HEADERS if with_headers else {}
-    resp = httpx.get(url, headers=headers, follow_redirects=True)
+    """
+    Return the JSON response of url.
+
+    Responses are stored compressed on disk and reused for CACHE_TTL,
+    after which they are revalidated with a conditional request.
+    Local mirror directories and file:// URLs are read directly.
+    """
+    if is_local(url):
+        data = read_local(url)
+    else:
+        meta, data = read_cache(url, with_headers)
+        if data is None or not is_fresh(meta):
+            headers = request_headers(meta, with_headers)
+            resp = httpx.get(url, headers=headers, follow_redirects=True)
+            data = handle_response(url, with_headers, meta, data, resp)
+
+    if data is not None:
+        RESPONSES[url] = data
+    return data
+
+
+async def get_resp_async(
+    client: httpx.AsyncClient, url, with_headers=True
+) -> dict[str, Any] | None:
+    """
+    Async version of get_resp.
+
+    Only the request is awaited on the event loop. Reading, decoding and
+    writing the cache run in worker threads to not hold up other requests.
+    """
+    if is_local(url):
+        data = await asyncio.to_thread(read_local, url)
+    else:
+        meta, data = await asyncio.to_thread(read_cache, url, with_headers)
+        if data is None or not is_fresh(meta):
+            headers = request_headers(meta, with_headers)
+            resp = await client.get(url, headers=headers)
+            data = await asyncio.to_thread(handle_response, url, with_headers, meta, data, resp)
+
+    if data is not None:
+        RESPONSES[url] = data
+    return data
+
+
+def handle_response(url, with_headers, meta, data, resp) -> dict[str, Any] | None:
+    if resp.status_code == httpx.codes.NOT_MODIFIED:
+        write_cache(url, with_headers, meta)
+        return data
+
     with suppress(httpx.HTTPError):
-        return resp.raise_for_status().json()
+        new_data = resp.raise_for_status().json()
+        meta = {
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+        }
+        write_cache(url, with_headers, meta, resp.content)
+        return new_data
+    # Revalidation failed, so fall back to the stale body if there is one
+    return data
 
 
 @cache
-def pypi_info(package: str, python_version: str = "3.10") -> tuple[str, ...]:
-    url = f"https://pypi.org/simple/{package}"
-    resp = get_resp(url, with_headers=True)
+def parse_requires_python(requires_python: str | None) -> SpecifierSet | None:
+    if requires_python is None:
+        return None
+    return SpecifierSet(requires_python.replace(".*", ""))
+
+
+def write_snapshot(dest, index=PYPI_URL) -> None:
+    """Write the responses used from index as a local mirror usable with --index."""
+    for url, data in RESPONSES.items():
+        if not url.startswith(index):
+            continue
+        path = local_path(os.path.join(dest, url.removeprefix(index).strip("/")))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(data))
+
+
+async def _fetch_all(requests, description, concurrency) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(http2=HTTP2, follow_redirects=True, timeout=30) as client:
+        with Progress(console=console, transient=True) as progress:
+            task = progress.add_task(description, total=len(requests))
+
+            async def fetch(url, parse):
+                async with semaphore:
+                    try:
+                        resp = await get_resp_async(client, url, with_headers=True)
+                    except httpx.HTTPError as e:
+                        # Treated as not found, so one failure does not abort the others
+                        err_console.print(f"[red]Could not fetch {url}: {e!r}[/red]")
+                        resp = None
+                # Parse in a worker thread to not hold up the other requests
+                result = await asyncio.to_thread(parse, resp)
+                progress.advance(task)
+                return result
+
+            return await asyncio.gather(*(fetch(url, parse) for url, parse in requests))
+
+
+def fetch_info_all(
+    packages, description, concurrency=MAX_CONCURRENCY, index=PYPI_URL
+) -> list[dict[str, tuple[str, ...]]]:
+    """Return parse_info_all for all packages, fetching at most concurrency at a time."""
+    requests = [(f"{index}/simple/{p}", partial(parse_info_all, p)) for p in packages]
+    return asyncio.run(_fetch_all(requests, description, concurrency))
+
+
+def fetch_requirements(
+    packages, description, concurrency=MAX_CONCURRENCY, index=PYPI_URL
+) -> list[list[Requirement]]:
+    requests = [(f"{index}/pypi/{p}/json", parse_requirements) for p in packages]
+    return asyncio.run(_fetch_all(requests, description, concurrency))
+
+
+def fetch_versions(
+    packages, description, concurrency=MAX_CONCURRENCY, index=PYPI_URL
+) -> list[list[Version]]:
+    requests = [(f"{index}/simple/{p}", parse_versions) for p in packages]
+    return asyncio.run(_fetch_all(requests, description, concurrency))
+
 
+def parse_info_all(package: str, resp: dict[str, Any] | None) -> dict[str, tuple[str, ...]]:
+    """Return the info of a package for all Python versions in py_releases."""
     if not resp:
-        return package, "-", "-", "-", "-"
+        return dict.fromkeys(py_releases, (package, "-", "-", "-", "-"))
 
     releases = collections.defaultdict(list)
-    results = collections.defaultdict(list)
+    results = {py: set() for py in py_releases}
     for f in resp["files"]:
         name = f["filename"]
         try:
@@ -117,24 +301,128 @@ def pypi_info(package: str, python_version: str = "3.10") -> tuple[str, ...]:
         release_date = datetime.fromisoformat(f["upload-time"]).replace(tzinfo=None)
         releases[version].append(release_date)
 
-        python_check1 = f["requires-python"] is None or (
-            SpecifierSet(f["requires-python"].replace(".*", "")).contains(python_version)
-        )
-        python_check2 = release_date >= py_releases[python_version]
-        if python_check1 and python_check2:
-            results[version].append(release_date)
+        specifier = parse_requires_python(f["requires-python"])
+        for python_version, python_date in py_releases.items():
+            python_check1 = specifier is None or specifier.contains(python_version)
+            python_check2 = release_date >= python_date
+            if python_check1 and python_check2:
+                results[python_version].add(version)
 
-    results = {v: min(results[v]) for v in results}
     releases = {v: min(releases[v]) for v in releases}
-
-    min_version = str(min(results)) if results else "-"
-    max_version = str(max(results)) if results else "-"
     cur_version = str(max(releases)) if releases else "-"
 
     spec0 = [r for r, d in releases.items() if r.micro == 0 and spec_drop_date <= d]
     spec0_version = str(min(spec0)) if spec0 else "-"
 
-    return package, min_version, max_version, cur_version, spec0_version
+    info = {}
+    for python_version, versions in results.items():
+        min_version = str(min(versions)) if versions else "-"
+        max_version = str(max(versions)) if versions else "-"
+        info[python_version] = (package, min_version, max_version, cur_version, spec0_version)
+    return info
+
+
+def parse_requirements(resp: dict[str, Any] | None) -> list[Requirement]:
+    """Return the non-optional requirements of the latest release."""
+    requirements = []
+    for r in (resp or {}).get("info", {}).get("requires_dist") or []:
+        with suppress(InvalidRequirement):
+            requirement = Requirement(r)
+            if requirement.marker is None or "extra" not in str(requirement.marker):
+                requirements.append(requirement)
+    return requirements
+
+
+def parse_versions(resp: dict[str, Any] | None) -> list[Version]:
+    versions = []
+    for v in (resp or {}).get("versions", []):
+        with suppress(InvalidVersion):
+            version = Version(v)
+            if not version.is_prerelease:
+                versions.append(version)
+    return versions
+
+
+def dependency_graph(
+    packages, depth, concurrency=MAX_CONCURRENCY, index=PYPI_URL
+) -> dict[str, dict[str, SpecifierSet]]:
+    """
+    Return the edges of the dependency graph with the specifier of each edge.
+
+    The packages are at depth 1, each level is fetched in parallel, and every
+    package is only fetched once.
+    """
+    graph = {}
+    level = sorted({canonicalize_name(p) for p in packages})
+    seen = set(level)
+    for d in range(2, depth + 1):
+        requirements = fetch_requirements(
+            level, f"Getting dependencies at depth {d}", concurrency, index
+        )
+        next_level = set()
+        for package, reqs in zip(level, requirements, strict=True):
+            edges = graph[package] = {}
+            for req in reqs:
+                name = canonicalize_name(req.name)
+                edges[name] = edges.get(name, SpecifierSet()) & req.specifier
+                if name not in seen:
+                    seen.add(name)
+                    next_level.add(name)
+        level = sorted(next_level)
+    return graph
+
+
+def constraint_paths(graph, packages, depth) -> dict[str, list[tuple[list[str], SpecifierSet]]]:
+    """Return every path up to depth from a direct dependency to each transitive dependency."""
+    direct = {canonicalize_name(p) for p in packages}
+    paths = collections.defaultdict(list)
+
+    def walk(path):
+        if len(path) >= depth:
+            return
+        for child, specifier in graph.get(path[-1], {}).items():
+            if child in path:
+                continue
+            if child not in direct:
+                paths[child].append(([*path, child], specifier))
+            walk([*path, child])
+
+    for package in sorted(direct):
+        walk([package])
+    return paths
+
+
+def constraint_table(main_package, graph, packages, depth, concurrency, index) -> Table:
+    paths = constraint_paths(graph, packages, depth)
+    transitive = sorted(paths)
+    versions = fetch_versions(
+        transitive, "Getting versions of transitive dependencies", concurrency, index
+    )
+
+    table = Table(title=f"Transitive constraints for {main_package.capitalize()}")
+    table.add_column("Package")
+    table.add_column("Path")
+    table.add_column("Constraint")
+    table.add_column("Minimum", justify="right", min_width=10)
+    table.add_column("Maximum", justify="right", min_width=10)
+
+    def add_row(package, path, specifier, package_versions):
+        allowed = list(specifier.filter(package_versions))
+        min_version = str(min(allowed)) if allowed else "-"
+        max_version = str(max(allowed)) if allowed else "-"
+        table.add_row(package, path, str(specifier) or "*", min_version, max_version)
+
+    for package, package_versions in zip(transitive, versions, strict=True):
+        for path, specifier in paths[package]:
+            add_row(package, " → ".join(path[:-1]), specifier, package_versions)
+        if len(paths[package]) > 1:
+            combined = SpecifierSet()
+            for _, specifier in paths[package]:
+                combined &= specifier
+            add_row(package, "(all paths)", combined, package_versions)
+        table.add_section()
+
+    return table
 
 
 def get_packages_from_file(main_package: str) -> tuple[set[str], str]:
@@ -172,11 +460,18 @@ def get_packages_from_file(main_package: str) -> tuple[set[str], str]:
         raise FileNotFoundError()
 
 
-def get_packages_from_pypi(main_package) -> tuple[set[str], str]:
-    url = f"https://pypi.org/pypi/{main_package}/json"
-    resp = get_resp(url)
-    if resp is None:
+def get_packages_from_pypi(main_package, index=PYPI_URL) -> tuple[set[str], str]:
+    url = f"{index}/pypi/{main_package}/json"
+    packages = parse_packages(get_resp(url))
+    if packages is None:
         exit_print(f"Package '{main_package}' not found.")
+    return packages
+
+
+def parse_packages(resp: dict[str, Any] | None) -> tuple[set[str], str] | None:
+    """Return the dependencies and minimum Python of a package, or None if not found."""
+    if resp is None:
+        return None
 
     python_requires = resp["info"]["requires_python"].replace(">=", "")
 
@@ -188,19 +483,33 @@ def get_packages_from_pypi(main_package) -> tuple[set[str], str]:
     return packages, python_requires
 
 
-def query(main_package, python_requires=None) -> None:
+def get_packages(main_package, index=PYPI_URL) -> tuple[set[str], str]:
     try:
-        packages, lowest_supported_python = get_packages_from_file(main_package)
+        return get_packages_from_file(main_package)
     except Exception:
-        packages, lowest_supported_python = get_packages_from_pypi(main_package)
+        return get_packages_from_pypi(main_package, index)
 
+
+def query(
+    main_package, python_requires=None, concurrency=MAX_CONCURRENCY, index=PYPI_URL, depth=1
+) -> None:
+    packages, lowest_supported_python = get_packages(main_package, index)
     python_requires = python_requires or lowest_supported_python
 
-    info = trackpool(
-        lambda p: pypi_info(p, python_requires),
+    info = fetch_info_all(
         sorted(packages),
         f"Getting dependencies info for {main_package}",
+        concurrency=concurrency,
+        index=index,
     )
+    if depth > 1:
+        graph = dependency_graph(packages, depth, concurrency, index)
+        console.print(constraint_table(main_package, graph, packages, depth, concurrency, index))
+
+    if python_requires == "all":
+        console.print(matrix_table(main_package, info))
+        return
+
     table = Table(
         title=f"Package information for {main_package.capitalize()} and Python {python_requires}"
     )
@@ -211,20 +520,160 @@ def query(main_package, python_requires=None) -> None:
     table.add_column("Spec 0", justify="right", min_width=10)
 
     for i in info:
-        table.add_row(*i)
+        table.add_row(*i[python_requires])
 
     console.print(table)
 
 
-def main() -> None:
+def matrix_table(main_package, info, python_versions=tuple(py_releases)) -> Table:
+    table = Table(title=f"Package information for {main_package.capitalize()} (minimum - maximum)")
+    table.add_column("Package")
+    for python_version in python_versions:
+        table.add_column(f"Python {python_version}", justify="right", min_width=10)
+    table.add_column("Current", justify="right", min_width=10)
+    table.add_column("Spec 0", justify="right", min_width=10)
+
+    for i in info:
+        rows = [i[python_version] for python_version in python_versions]
+        package, *_, cur_version, spec0_version = rows[0]
+        versions = [f"{min_version} - {max_version}" for _, min_version, max_version, *_ in rows]
+        table.add_row(package, *versions, cur_version, spec0_version)
+
+    return table
+
+
+def batch(
+    main_packages, concurrency=MAX_CONCURRENCY, index=PYPI_URL
+) -> tuple[dict[str, set[str]], dict[str, dict[str, tuple[str, ...]]]]:
+    """
+    Return the dependencies of each main package and the info of every dependency.
+
+    Dependencies shared between the main packages are only fetched once,
+    and main packages which are not found are reported and skipped.
+    """
+    dependencies, remote = {}, []
+    for main_package in main_packages:
+        try:
+            dependencies[main_package] = get_packages_from_file(main_package)[0]
+        except Exception:
+            remote.append(main_package)
+
+    requests = [(f"{index}/pypi/{p}/json", parse_packages) for p in remote]
+    found = asyncio.run(_fetch_all(requests, "Getting packages info", concurrency))
+    for main_package, packages in zip(remote, found, strict=True):
+        if packages is None:
+            err_console.print(f"[red]Package '{main_package}' not found, skipping it.[/red]")
+        else:
+            dependencies[main_package] = packages[0]
+    dependencies = {p: dependencies[p] for p in main_packages if p in dependencies}
+
+    packages = sorted(set().union(*dependencies.values()))
+    info = fetch_info_all(packages, "Getting dependencies info", concurrency, index)
+    return dependencies, dict(zip(packages, info, strict=True))
+
+
+def batch_rows(dependencies, info, python_versions) -> list[dict[str, str]]:
+    rows = []
+    for main_package, packages in dependencies.items():
+        for package in sorted(packages):
+            for python_version in python_versions:
+                values = (main_package, python_version, *info[package][python_version])
+                rows.append(dict(zip(BATCH_FIELDS, values, strict=True)))
+    return rows
+
+
+def write_batch(dependencies, info, python_versions, output_format, output) -> None:
+    if output_format == "table":
+        for main_package, packages in dependencies.items():
+            package_info = [info[p] for p in sorted(packages)]
+            console.print(matrix_table(main_package, package_info, python_versions))
+        return
+
+    rows = batch_rows(dependencies, info, python_versions)
+    with click.open_file(output, "w") as f:
+        if output_format == "json":
+            json.dump(rows, f, indent=2)
+            f.write("\n")
+        else:
+            writer = csv.DictWriter(f, fieldnames=BATCH_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+@click.command(context_settings={"show_default": True})
+@click.argument("packages", nargs=-1)
+@click.option(
+    "--python",
+    "python_versions",
+    multiple=True,
+    type=click.Choice(list(py_releases)),
+    help="Python versions to include with packages, defaults to all",
+)
+@click.option(
+    "--format",
+    "output_format",
+    default="table",
+    type=click.Choice(["table", "json", "csv"]),
+    help="Output format with packages",
+)
+@click.option(
+    "--output",
+    default="-",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    help="File to write json or csv output to",
+)
+@click.option(
+    "--index",
+    default=PYPI_URL,
+    help="Index to query, either a URL or a local directory / file:// URL of a mirror",
+)
+@click.option(
+    "--snapshot",
+    type=click.Path(file_okay=False),
+    help="Write the responses used to this directory as a mirror usable with --index",
+)
+@click.option(
+    "--concurrency",
+    default=MAX_CONCURRENCY,
+    help="Maximum number of concurrent requests",
+)
+@click.option(
+    "--depth",
+    default=1,
+    help="Depth of dependencies to analyse, transitive constraints are shown above 1 (not with PACKAGES)",
+)
+def main(
+    packages, python_versions, output_format, output, index, snapshot, concurrency, depth
+) -> None:
+    """
+    Get dependencies info for packages.
+
+    Without PACKAGES, packages are asked for one at a time. With PACKAGES, the
+    dependencies of all of them are analysed together and written in one go.
+    """
+    index = index.rstrip("/")
+    if packages and depth > 1:
+        msg = "--depth above 1 is only supported without PACKAGES"
+        raise click.UsageError(msg)
+    if packages:
+        dependencies, info = batch(packages, concurrency, index)
+        write_batch(
+            dependencies, info, python_versions or list(py_releases), output_format, output
+        )
+        if snapshot:
+            write_snapshot(snapshot, index)
+        return
+
     while True:
         main_package = Prompt.ask("Package (empty to quit)", console=console)
         if not main_package:
             break
 
-        py = list(py_releases)
+        py = [*py_releases, "all"]
         python_requires = Prompt.ask("Python version", console=console, choices=py, default=py[0])
-        query(main_package, python_requires)
+        query(main_package, python_requires, concurrency=concurrency, index=index, depth=depth)
+        if snapshot:
+            write_snapshot(snapshot, index)
 
 
 if __name__ == "__main__":